@@ -1,15 +1,26 @@
 import gradio as gr
 import replicate
 import os
+import asyncio
+from functools import lru_cache
 from dotenv import load_dotenv
 import uuid
 import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageDraw, ImageFont
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
-import json
-from urllib.parse import quote
+import orjson
+import html
+import gzip
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 
 # ===========================
 # CONFIGURATION
@@ -30,10 +41,14 @@ R2_SECRET_ACCESS_KEY = os.environ.get("R2_SECRET_ACCESS_KEY", "")
 R2_BUCKET_NAME = os.environ.get("R2_BUCKET_NAME", "greeting-cards")
 R2_PUBLIC_URL = os.environ.get("R2_PUBLIC_URL", "")  # e.g., https://your-domain.com
 
+# Checked once here so the storage helpers can short-circuit when R2 isn't configured
+R2_ENABLED = bool(R2_ACCOUNT_ID and R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY)
+
 # Initialize R2 client
+@lru_cache(maxsize=1)
 def init_r2_client():
-    """Initialize Cloudflare R2 client using boto3"""
-    if not all([R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY]):
+    """Initialize Cloudflare R2 client using boto3 (created once and reused)"""
+    if not R2_ENABLED:
         return None
     
     try:
@@ -42,7 +57,13 @@ def init_r2_client():
             endpoint_url=f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
             aws_access_key_id=R2_ACCESS_KEY_ID,
             aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-            config=Config(signature_version='s3v4'),
+            config=Config(
+                signature_version='s3v4',
+                # Shared across threads, so keep a large pool of warm connections
+                max_pool_connections=50,
+                retries={'max_attempts': 3, 'mode': 'adaptive'},
+                tcp_keepalive=True
+            ),
             region_name='auto'
         )
         return s3_client
@@ -50,109 +71,168 @@ def init_r2_client():
         print(f"Error initializing R2 client: {e}")
         return None
 
+# Create the client once at startup so every request reuses its connection pool
+init_r2_client()
+
+# Shared HTTP session for image downloads (pooled connections with retries)
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+    )
+)
+
+# Background workers for R2 uploads so cards are returned without waiting on storage
+UPLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+UPLOAD_ATTEMPTS = 3
+
+# Multipart settings for image uploads. Parts can't be smaller than 5 MiB (R2 and
+# s3transfer both enforce it), and the threshold stays at the chunk size so nothing
+# goes up as a one-part multipart upload. Typical cards (~2 MB) use a single PUT.
+R2_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# In-flight uploads, keyed by card_id
+PENDING_UPLOADS = {}
+
+# Card metadata never changes once written, so repeat views are served from memory
+METADATA_CACHE = TTLCache(maxsize=1024, ttl=3600)
+METADATA_CACHE_LOCK = threading.Lock()
+
 # ===========================
 # CARD TEMPLATES
 # ===========================
 
 CARD_TEMPLATES = {
     "Birthday": {
-        "prompt": "A vibrant, celebratory birthday scene with colorful balloons, confetti, and a festive atmosphere. Warm lighting, joyful colors including pink, gold, and blue. Shot in high-quality digital photography style with bokeh effect. {recipient} {message} {date} {details}",
+        "base_prompt": "A vibrant, celebratory birthday scene with colorful balloons, confetti, and a festive atmosphere. Warm lighting, joyful colors including pink, gold, and blue. Shot in high-quality digital photography style with bokeh effect.",
         "aspect_ratio": "16:9",
         "description": "Perfect for birthday celebrations with colorful and festive elements"
     },
     "Christmas": {
-        "prompt": "A cozy Christmas scene with decorated pine tree, warm fireplace, snow falling outside window, red and gold ornaments, twinkling lights. Nostalgic winter holiday atmosphere with rich textures and warm color palette. Shot in cinematic film style. {recipient} {message} {date} {details}",
+        "base_prompt": "A cozy Christmas scene with decorated pine tree, warm fireplace, snow falling outside window, red and gold ornaments, twinkling lights. Nostalgic winter holiday atmosphere with rich textures and warm color palette. Shot in cinematic film style.",
         "aspect_ratio": "16:9",
         "description": "Warm holiday scene with Christmas tree and festive decorations"
     },
     "Halloween": {
-        "prompt": "A spooky yet charming Halloween scene with carved pumpkins, autumn leaves, vintage lanterns casting warm orange glow, misty atmosphere. Gothic aesthetic with orange, purple, and black color scheme. Atmospheric fog and dramatic lighting. {recipient} {message} {date} {details}",
+        "base_prompt": "A spooky yet charming Halloween scene with carved pumpkins, autumn leaves, vintage lanterns casting warm orange glow, misty atmosphere. Gothic aesthetic with orange, purple, and black color scheme. Atmospheric fog and dramatic lighting.",
         "aspect_ratio": "16:9",
         "description": "Spooky autumn scene with pumpkins and mysterious atmosphere"
     },
     "Easter": {
-        "prompt": "A cheerful Easter scene with pastel colors, decorated eggs in basket, spring flowers blooming, soft morning sunlight, meadow setting. Gentle, dreamy photography style with soft focus. Colors: soft pink, lavender, mint green, and cream. {recipient} {message} {date} {details}",
+        "base_prompt": "A cheerful Easter scene with pastel colors, decorated eggs in basket, spring flowers blooming, soft morning sunlight, meadow setting. Gentle, dreamy photography style with soft focus. Colors: soft pink, lavender, mint green, and cream.",
         "aspect_ratio": "16:9",
         "description": "Springtime scene with Easter eggs and blooming flowers"
     },
     "Valentine's Day": {
-        "prompt": "A romantic Valentine's Day scene with roses, soft candlelight, elegant table setting, dreamy bokeh lights in background. Rich reds and soft pinks, luxurious and intimate atmosphere. Professional photography with shallow depth of field. {recipient} {message} {date} {details}",
+        "base_prompt": "A romantic Valentine's Day scene with roses, soft candlelight, elegant table setting, dreamy bokeh lights in background. Rich reds and soft pinks, luxurious and intimate atmosphere. Professional photography with shallow depth of field.",
         "aspect_ratio": "16:9",
         "description": "Romantic scene with roses and elegant candlelit setting"
     },
     "Thanksgiving": {
-        "prompt": "A warm Thanksgiving scene with harvest table, autumn decorations, pumpkins, golden wheat, warm candles, rustic wooden setting. Rich autumn colors: orange, burgundy, gold, brown. Cozy family gathering atmosphere. {recipient} {message} {date} {details}",
+        "base_prompt": "A warm Thanksgiving scene with harvest table, autumn decorations, pumpkins, golden wheat, warm candles, rustic wooden setting. Rich autumn colors: orange, burgundy, gold, brown. Cozy family gathering atmosphere.",
         "aspect_ratio": "16:9",
         "description": "Harvest scene with autumn colors and cozy atmosphere"
     },
     "New Year": {
-        "prompt": "An elegant New Year's celebration scene with champagne glasses, fireworks, golden confetti, clock showing midnight, sophisticated party setting. Luxurious color palette: gold, silver, black, deep blue. Celebratory and hopeful atmosphere. {recipient} {message} {date} {details}",
+        "base_prompt": "An elegant New Year's celebration scene with champagne glasses, fireworks, golden confetti, clock showing midnight, sophisticated party setting. Luxurious color palette: gold, silver, black, deep blue. Celebratory and hopeful atmosphere.",
         "aspect_ratio": "16:9",
         "description": "Sophisticated celebration with champagne and fireworks"
     },
     "Graduation": {
-        "prompt": "An inspiring graduation scene with cap and diploma, books, achievement symbols, bright future ahead imagery. Colors: traditional academic blue, gold, white. Uplifting and proud atmosphere with professional photography style. {recipient} {message} {date} {details}",
+        "base_prompt": "An inspiring graduation scene with cap and diploma, books, achievement symbols, bright future ahead imagery. Colors: traditional academic blue, gold, white. Uplifting and proud atmosphere with professional photography style.",
         "aspect_ratio": "16:9",
         "description": "Academic achievement scene with cap and diploma"
     },
     "Wedding": {
-        "prompt": "An elegant wedding scene with beautiful floral arrangements, soft romantic lighting, elegant venue details, delicate lace and fabric textures. Soft color palette: ivory, blush pink, champagne, sage green. Dreamy and romantic atmosphere. {recipient} {message} {date} {details}",
+        "base_prompt": "An elegant wedding scene with beautiful floral arrangements, soft romantic lighting, elegant venue details, delicate lace and fabric textures. Soft color palette: ivory, blush pink, champagne, sage green. Dreamy and romantic atmosphere.",
         "aspect_ratio": "16:9",
         "description": "Elegant romantic scene with flowers and soft lighting"
     },
     "Thank You": {
-        "prompt": "A warm, appreciative scene with elegant flowers in vase, handwritten note aesthetic, natural morning light through window, cozy interior setting. Soft, grateful atmosphere with cream, sage, and gold tones. {recipient} {message} {date} {details}",
+        "base_prompt": "A warm, appreciative scene with elegant flowers in vase, handwritten note aesthetic, natural morning light through window, cozy interior setting. Soft, grateful atmosphere with cream, sage, and gold tones.",
         "aspect_ratio": "16:9",
         "description": "Warm scene expressing gratitude with flowers and elegant details"
     }
 }
 
+# Precomputed for the UI so dropdown changes are a single dict lookup
+TEMPLATE_NAMES = tuple(CARD_TEMPLATES.keys())
+TEMPLATE_DESCRIPTIONS = {name: template["description"] for name, template in CARD_TEMPLATES.items()}
+
 # ===========================
 # HELPER FUNCTIONS
 # ===========================
 
-def add_watermark(image_path, output_path):
-    """Add 'AlexAI Cards' watermark to image in elegant font at bottom right"""
+def open_image(image_input):
+    """Return a PIL image from a PIL image, raw bytes, a file object or a file path"""
+    if isinstance(image_input, Image.Image):
+        return image_input
+    if isinstance(image_input, (bytes, bytearray)):
+        image_input = io.BytesIO(image_input)
+    return Image.open(image_input)
+
+# Watermark text and the elegant fonts to try, in order of preference
+WATERMARK_TEXT = "AlexAI Cards"
+WATERMARK_FONT_OPTIONS = [
+    "arial.ttf",
+    "times.ttf",
+    "Georgia.ttf",
+    "/System/Library/Fonts/Supplemental/Georgia.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"
+]
+
+# JPEG encoding for cards: 4:2:0 subsampling, no Huffman optimization pass
+JPEG_SAVE_OPTIONS = {
+    "quality": 90,
+    "optimize": False,
+    "progressive": False,
+    "subsampling": 2
+}
+
+@lru_cache(maxsize=32)
+def get_watermark_font(font_size):
+    """Load the first available watermark font at font_size (cached per size)"""
+    for font_path in WATERMARK_FONT_OPTIONS:
+        try:
+            return ImageFont.truetype(font_path, font_size)
+        except:
+            continue
+    
+    return ImageFont.load_default()
+
+@lru_cache(maxsize=32)
+def get_watermark_bbox(font_size):
+    """Bounding box of the watermark text at font_size (cached per size)"""
+    return get_watermark_font(font_size).getbbox(WATERMARK_TEXT)
+
+def add_watermark(image_input):
+    """Add 'AlexAI Cards' watermark to image in elegant font at bottom right
+    
+    Accepts a PIL image (watermarked in place), raw image bytes, a file object
+    or a file path, and returns the JPEG in an in-memory buffer.
+    """
+    output = io.BytesIO()
     try:
-        # Open image
-        img = Image.open(image_path).convert("RGBA")
-        
-        # Create transparent overlay
-        txt_layer = Image.new('RGBA', img.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
-        
-        # Watermark text
-        watermark_text = "AlexAI Cards"
+        # Open image (kept in RGB - only the watermark region is blended)
+        img = open_image(image_input)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
         
         # Calculate font size based on image dimensions (2% of image height)
         img_width, img_height = img.size
         font_size = int(img_height * 0.025)
         
-        # Try to load an elegant font, fallback to default
-        try:
-            # Try multiple elegant font options
-            font_options = [
-                "arial.ttf",
-                "times.ttf",
-                "Georgia.ttf",
-                "/System/Library/Fonts/Supplemental/Georgia.ttf",
-                "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"
-            ]
-            font = None
-            for font_path in font_options:
-                try:
-                    font = ImageFont.truetype(font_path, font_size)
-                    break
-                except:
-                    continue
-            
-            if font is None:
-                font = ImageFont.load_default()
-        except:
-            font = ImageFont.load_default()
-        
-        # Get text dimensions using textbbox
-        bbox = draw.textbbox((0, 0), watermark_text, font=font)
+        # Font and text dimensions only depend on the font size, so they are cached
+        font = get_watermark_font(font_size)
+        bbox = get_watermark_bbox(font_size)
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
         
@@ -161,74 +241,134 @@ def add_watermark(image_path, output_path):
         x = img_width - text_width - margin
         y = img_height - text_height - margin
         
-        # Draw watermark with semi-transparency (white with 60% opacity)
-        draw.text((x, y), watermark_text, fill=(255, 255, 255, 153), font=font)
+        # Crop just the pixels the text covers instead of overlaying the full image
+        box = (x + bbox[0], y + bbox[1], x + bbox[2], y + bbox[3])
+        region = img.crop(box).convert("RGBA")
         
-        # Composite the watermark onto the original image
-        watermarked = Image.alpha_composite(img, txt_layer)
+        # Draw watermark with semi-transparency (white with 60% opacity)
+        txt_layer = Image.new('RGBA', region.size, (255, 255, 255, 0))
+        draw = ImageDraw.Draw(txt_layer)
+        draw.text((-bbox[0], -bbox[1]), WATERMARK_TEXT, fill=(255, 255, 255, 153), font=font)
         
-        # Convert back to RGB and save
-        watermarked_rgb = watermarked.convert("RGB")
-        watermarked_rgb.save(output_path, "JPEG", quality=95)
+        # Composite the watermark onto the region and paste it back
+        region = Image.alpha_composite(region, txt_layer)
+        img.paste(region.convert("RGB"), box[:2])
         
-        return output_path
+        img.save(output, "JPEG", **JPEG_SAVE_OPTIONS)
     except Exception as e:
         print(f"Watermark error: {e}")
         # If watermarking fails, just copy the original
-        img = Image.open(image_path)
-        img.save(output_path, "JPEG", quality=95)
-        return output_path
+        output = io.BytesIO()
+        img = open_image(image_input)
+        img.save(output, "JPEG", **JPEG_SAVE_OPTIONS)
+    
+    output.seek(0)
+    return output
 
-def upload_to_r2(file_path, card_id):
-    """Upload image to Cloudflare R2 and return public URL"""
+def download_image(url, target):
+    """Stream an image from url into a writable file object"""
+    with HTTP_SESSION.get(url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            target.write(chunk)
+
+def object_public_url(card_id):
+    """Public URL of a card image in R2 (known before the upload happens)"""
+    object_key = f"cards/{card_id}.jpg"
+    if R2_PUBLIC_URL:
+        return f"{R2_PUBLIC_URL}/{object_key}"
+    return f"https://{R2_BUCKET_NAME}.r2.cloudflarestorage.com/{object_key}"
+
+@lru_cache(maxsize=1)
+def warm_r2_connection():
+    """Open the first pooled connection to R2 (DNS + TLS) ahead of the first upload"""
     s3_client = init_r2_client()
+    if not s3_client:
+        return False
     
+    try:
+        s3_client.head_bucket(Bucket=R2_BUCKET_NAME)
+    except Exception as e:
+        # Tokens without bucket-level access are refused, but the connection is still warm
+        print(f"R2 warmup: {e}")
+    return True
+
+def card_image_url(card_id, metadata):
+    """URL a viewer's browser can load the card image from directly"""
+    if R2_PUBLIC_URL:
+        return metadata.get("image_url")
+    
+    if not R2_ENABLED:
+        return None
+    
+    s3_client = init_r2_client()
     if not s3_client:
-        print("R2 client not initialized - storing locally only")
         return None
     
+    # Private bucket: hand out a short-lived presigned URL instead of proxying the image
     try:
-        # Upload to R2
-        object_key = f"cards/{card_id}.jpg"
-        
-        with open(file_path, 'rb') as f:
+        return s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': R2_BUCKET_NAME, 'Key': f"cards/{card_id}.jpg"},
+            ExpiresIn=900
+        )
+    except Exception as e:
+        print(f"Presigned URL error: {e}")
+        return None
+
+def upload_to_r2(image_bytes, card_id):
+    """Upload in-memory JPEG bytes to Cloudflare R2, returning True on success"""
+    if not R2_ENABLED:
+        return False
+    
+    s3_client = init_r2_client()
+    if not s3_client:
+        print("R2 client not initialized - storing locally only")
+        return False
+    
+    # Upload to R2, retrying with exponential backoff
+    object_key = f"cards/{card_id}.jpg"
+    
+    for attempt in range(UPLOAD_ATTEMPTS):
+        try:
             s3_client.upload_fileobj(
-                f,
+                io.BytesIO(image_bytes),
                 R2_BUCKET_NAME,
                 object_key,
                 ExtraArgs={
                     'ContentType': 'image/jpeg',
                     'CacheControl': 'public, max-age=31536000'
-                }
+                },
+                Config=R2_TRANSFER_CONFIG
             )
-        
-        # Generate public URL
-        if R2_PUBLIC_URL:
-            public_url = f"{R2_PUBLIC_URL}/{object_key}"
-        else:
-            public_url = f"https://{R2_BUCKET_NAME}.r2.cloudflarestorage.com/{object_key}"
-        
-        return public_url
-    except Exception as e:
-        print(f"R2 upload error: {e}")
-        return None
+            return True
+        except Exception as e:
+            print(f"R2 upload error (attempt {attempt + 1}/{UPLOAD_ATTEMPTS}): {e}")
+            if attempt < UPLOAD_ATTEMPTS - 1:
+                time.sleep(2 ** attempt)
+    
+    return False
 
 def save_card_metadata(card_id, metadata):
     """Save card metadata to R2"""
-    s3_client = init_r2_client()
+    if not R2_ENABLED:
+        return None
     
+    s3_client = init_r2_client()
     if not s3_client:
         return None
     
     try:
         metadata_key = f"metadata/{card_id}.json"
-        metadata_json = json.dumps(metadata)
         
+        # Metadata never changes once written, so let R2's edge cache it
         s3_client.put_object(
             Bucket=R2_BUCKET_NAME,
             Key=metadata_key,
-            Body=metadata_json.encode('utf-8'),
-            ContentType='application/json'
+            Body=gzip.compress(orjson.dumps(metadata)),
+            ContentType='application/json',
+            ContentEncoding='gzip',
+            CacheControl='public, max-age=86400'
         )
         
         return metadata_key
@@ -237,33 +377,87 @@ def save_card_metadata(card_id, metadata):
         return None
 
 def get_card_metadata(card_id):
-    """Retrieve card metadata from R2"""
-    s3_client = init_r2_client()
+    """Retrieve card metadata from R2 (found cards are cached in memory)"""
+    if not R2_ENABLED:
+        return None
     
+    with METADATA_CACHE_LOCK:
+        metadata = METADATA_CACHE.get(card_id)
+    if metadata is not None:
+        return metadata
+    
+    s3_client = init_r2_client()
     if not s3_client:
         return None
     
     try:
         metadata_key = f"metadata/{card_id}.json"
         response = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=metadata_key)
-        metadata = json.loads(response['Body'].read().decode('utf-8'))
+        body = response['Body'].read()
+        
+        # boto3 doesn't decompress, and older cards were stored uncompressed
+        if response.get('ContentEncoding') == 'gzip':
+            body = gzip.decompress(body)
+        
+        metadata = orjson.loads(body)
+        
+        # Only found cards are cached, so a card that's still uploading isn't stuck as missing
+        with METADATA_CACHE_LOCK:
+            METADATA_CACHE[card_id] = metadata
         return metadata
     except Exception as e:
         print(f"Metadata retrieve error: {e}")
         return None
 
+def track_pending_upload(card_id, futures):
+    """Record the in-flight upload futures for card_id until they have all finished"""
+    PENDING_UPLOADS[card_id] = futures
+    
+    def on_done(_):
+        if all(f.done() for f in futures):
+            PENDING_UPLOADS.pop(card_id, None)
+    
+    for future in futures:
+        future.add_done_callback(on_done)
+
+def wait_for_pending_upload(card_id, timeout=60):
+    """Block until in-flight uploads for card_id (if any) have finished"""
+    futures = PENDING_UPLOADS.get(card_id)
+    if not futures:
+        return
+    
+    done, _ = wait(futures, timeout=timeout)
+    for future in done:
+        if future.exception():
+            print(f"Pending upload error: {future.exception()}")
+
 # ===========================
 # CARD GENERATION
 # ===========================
 
-def generate_greeting_card(
+def save_watermarked_card(image_data, card_id):
+    """Watermark a generated image, returning its JPEG bytes and the local file path"""
+    # Add watermark straight from the downloaded bytes (kept in memory for the upload)
+    watermarked_bytes = add_watermark(image_data).getvalue()
+    
+    # Gradio's Image(type="filepath") needs a file, so this is the only disk write
+    watermarked_path = f"/tmp/card_{card_id}_watermarked.jpg"
+    with open(watermarked_path, "wb") as f:
+        f.write(watermarked_bytes)
+    
+    return watermarked_bytes, watermarked_path
+
+async def generate_greeting_card(
     template_name,
     recipient_name,
     custom_message,
     date_text,
     additional_details
 ):
-    """Generate a greeting card using Seedream-4.5"""
+    """Generate a greeting card using Seedream-4.5
+    
+    Runs on Gradio's event loop; blocking download and Pillow work is moved to threads.
+    """
     
     status_messages = []
     
@@ -281,16 +475,11 @@ def generate_greeting_card(
         date_part = f"The date '{date_text}' should be displayed." if date_text else ""
         details_part = f"Include these elements: {additional_details}." if additional_details else ""
         
-        # Format prompt
-        prompt = template["prompt"].format(
-            recipient=recipient_part,
-            message=message_part,
-            date=date_part,
-            details=details_part
-        )
-        
-        # Clean up extra whitespace
-        prompt = " ".join(prompt.split())
+        # Build prompt from the base scene plus only the parts that were provided
+        parts = [template["base_prompt"]] + [
+            part for part in (recipient_part, message_part, date_part, details_part) if part
+        ]
+        prompt = " ".join(parts)
         
         status_messages.append("🎨 Generating image with Seedream-4.5...")
         
@@ -301,7 +490,7 @@ def generate_greeting_card(
             "aspect_ratio": template["aspect_ratio"]
         }
         
-        output = replicate.run(
+        output = await replicate.async_run(
             "bytedance/seedream-4.5",
             input=input_params
         )
@@ -310,12 +499,16 @@ def generate_greeting_card(
         
         # Download image
         # Handle both object with .read() (newer replicate) and URL string (older/other models)
-        if hasattr(output[0], 'read'):
-            image_data = output[0].read()
+        if hasattr(output[0], 'aread'):
+            image_data = await output[0].aread()
+            image_url = output[0].url if hasattr(output[0], 'url') else None
+        elif hasattr(output[0], 'read'):
+            image_data = await asyncio.to_thread(output[0].read)
             image_url = output[0].url if hasattr(output[0], 'url') else None
         elif isinstance(output[0], str) and output[0].startswith('http'):
-            import requests
-            image_data = requests.get(output[0]).content
+            buffer = io.BytesIO()
+            await asyncio.to_thread(download_image, output[0], buffer)
+            image_data = buffer.getvalue()
             image_url = output[0]
         else:
             raise ValueError(f"Unexpected output format: {type(output[0])}")
@@ -324,35 +517,38 @@ def generate_greeting_card(
         card_id = str(uuid.uuid4())
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        # Save original
-        original_path = f"/tmp/card_{card_id}_original.jpg"
-        with open(original_path, "wb") as f:
-            f.write(image_data)
-        
         status_messages.append("🎨 Adding watermark...")
         
-        # Add watermark
-        watermarked_path = f"/tmp/card_{card_id}_watermarked.jpg"
-        add_watermark(original_path, watermarked_path)
-        
-        status_messages.append("☁️ Uploading to cloud storage...")
-        
-        # Upload to R2
-        public_url = upload_to_r2(watermarked_path, card_id)
+        # Warm the R2 connection (I/O-bound) while watermarking (CPU-bound, kept off
+        # the event loop). Only the first card pays for the handshake.
+        if R2_ENABLED:
+            UPLOAD_EXECUTOR.submit(warm_r2_connection)
+        watermarked_bytes, watermarked_path = await asyncio.to_thread(
+            save_watermarked_card, image_data, card_id
+        )
         
-        # Save metadata
-        metadata = {
-            "card_id": card_id,
-            "template": template_name,
-            "recipient": recipient_name,
-            "message": custom_message,
-            "date": date_text,
-            "created_at": datetime.now().isoformat(),
-            "image_url": public_url
-        }
-        save_card_metadata(card_id, metadata)
+        if R2_ENABLED:
+            status_messages.append("☁️ Uploading to cloud storage in the background...")
+            
+            # Upload image and metadata to R2 in parallel, without blocking the response.
+            # The image URL is deterministic, so the metadata doesn't wait for the image.
+            metadata = {
+                "card_id": card_id,
+                "template": template_name,
+                "recipient": recipient_name,
+                "message": custom_message,
+                "date": date_text,
+                "created_at": datetime.now(),
+                "image_url": object_public_url(card_id)
+            }
+            track_pending_upload(card_id, [
+                UPLOAD_EXECUTOR.submit(upload_to_r2, watermarked_bytes, card_id),
+                UPLOAD_EXECUTOR.submit(save_card_metadata, card_id, metadata)
+            ])
+        else:
+            status_messages.append("💾 Cloud storage not configured - card stored locally only")
         
-        # Generate shareable link
+        # Generate shareable link (known before the upload finishes)
         share_link = f"{os.environ.get('APP_URL', 'http://localhost:7860')}/view?id={card_id}"
         
         status_messages.append("✨ Card created successfully!")
@@ -400,14 +596,14 @@ def create_card_interface():
                         gr.Markdown("### Card Details")
                         
                         template_dropdown = gr.Dropdown(
-                            choices=list(CARD_TEMPLATES.keys()),
+                            choices=TEMPLATE_NAMES,
                             value="Birthday",
                             label="Select Card Template",
                             info="Choose the occasion for your card"
                         )
                         
                         template_description = gr.Markdown(
-                            CARD_TEMPLATES["Birthday"]["description"],
+                            TEMPLATE_DESCRIPTIONS["Birthday"],
                             elem_classes="template-desc"
                         )
                         
@@ -476,7 +672,7 @@ def create_card_interface():
                 
                 # Update description when template changes
                 def update_template_desc(template_name):
-                    return CARD_TEMPLATES[template_name]["description"]
+                    return TEMPLATE_DESCRIPTIONS[template_name]
                 
                 template_dropdown.change(
                     fn=update_template_desc,
@@ -494,7 +690,9 @@ def create_card_interface():
                         date_input,
                         details_input
                     ],
-                    outputs=[image_output, share_link_output, status_output]
+                    outputs=[image_output, share_link_output, status_output],
+                    concurrency_limit=4,
+                    concurrency_id="gen"
                 )
             
             # ===== VIEW TAB =====
@@ -514,11 +712,9 @@ def create_card_interface():
                     )
                     view_btn = gr.Button("View Card", scale=1)
                 
-                view_output = gr.Image(
-                    label="Card",
-                    type="filepath",
-                    buttons=["download"]
-                )
+                # Rendered as HTML so the browser loads the image from R2 itself
+                # (gr.Image would download a URL value through the server first)
+                view_output = gr.HTML(label="Card")
                 
                 view_info = gr.JSON(label="Card Information")
                 
@@ -527,21 +723,23 @@ def create_card_interface():
                     if not card_id:
                         return None, {"error": "Please enter a card ID"}
                     
+                    # The card may have been created moments ago and still be uploading
+                    wait_for_pending_upload(card_id)
+                    
                     metadata = get_card_metadata(card_id)
                     if not metadata:
                         return None, {"error": "Card not found"}
                     
-                    # Download image if available
-                    if metadata.get("image_url"):
-                        try:
-                            import requests
-                            response = requests.get(metadata["image_url"])
-                            temp_path = f"/tmp/view_{card_id}.jpg"
-                            with open(temp_path, "wb") as f:
-                                f.write(response.content)
-                            return temp_path, metadata
-                        except:
-                            return None, metadata
+                    # Let the browser fetch the image straight from R2
+                    image_url = card_image_url(card_id, metadata)
+                    if image_url:
+                        url = html.escape(image_url, quote=True)
+                        card_html = (
+                            f'<a href="{url}" target="_blank" title="Open full resolution">'
+                            f'<img src="{url}" alt="Greeting card" class="card-preview" style="width: 100%;">'
+                            f'</a>'
+                        )
+                        return card_html, metadata
                     
                     return None, metadata
                 
@@ -577,7 +775,7 @@ def create_card_interface():
                     - **Image Model**: Seedream-4.5 by ByteDance
                     - **Resolution**: 4K (3840x2160)
                     - **Storage**: Cloudflare R2 Object Storage
-                    - **Format**: JPEG with 95% quality
+                    - **Format**: JPEG with 90% quality
                     
                     ### Setup Requirements
                     To run this app, you need:
@@ -600,6 +798,9 @@ def create_card_interface():
 
 if __name__ == "__main__":
     demo = create_card_interface()
+    
+    # Queue requests so concurrent users can't fan out unbounded Replicate calls and uploads
+    demo.queue(default_concurrency_limit=4, max_size=64)
     demo.launch(
         share=True,
         server_name="0.0.0.0",
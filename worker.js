@@ -47,7 +47,7 @@ export default {
           });
         }
 
-        const metadata = await metadataObj.json();
+        const metadata = await readMetadata(metadataObj);
         
         // Fetch card image from R2
         const imageKey = `cards/${cardId}.jpg`;
@@ -127,7 +127,7 @@ export default {
           });
         }
 
-        const metadata = await metadataObj.json();
+        const metadata = await readMetadata(metadataObj);
         
         return new Response(JSON.stringify(metadata), {
           headers: {
@@ -157,6 +157,17 @@ export default {
   }
 };
 
+/**
+ * Parse card metadata from an R2 object (the app stores it gzip-compressed)
+ */
+async function readMetadata(metadataObj) {
+  if (metadataObj.httpMetadata?.contentEncoding === 'gzip') {
+    const stream = metadataObj.body.pipeThrough(new DecompressionStream('gzip'));
+    return new Response(stream).json();
+  }
+  return metadataObj.json();
+}
+
 /**
  * Generate HTML for viewing a card
  */